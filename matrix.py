@@ -1,23 +1,83 @@
 import sublime
 import sublime_plugin
 
-import pathlib
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+def _rref_nb(A):
+    """Row reduce a float64 ndarray in place"""
+    rows, cols = A.shape
+    h = 0
+    k = 0
+    while h < rows and k < cols:
+        pivot_row = h
+        for i in range(h+1, rows):
+            if abs(A[i, k]) > abs(A[pivot_row, k]):
+                pivot_row = i
+        pivot_val = A[pivot_row, k]
+
+        if pivot_val == 0:
+            k += 1
+            continue
+
+        for j in range(cols):
+            A[h, j], A[pivot_row, j] = A[pivot_row, j], A[h, j]
+        A[h, k] = 1.0
+        for j in range(k+1, cols):
+            A[h, j] /= pivot_val
+
+        for i in range(rows):
+            if i == h:
+                continue
+            f = A[i, k]
+            A[i, k] = 0
+            for j in range(k+1, cols):
+                A[i, j] -= A[h, j]*f
+
+        h += 1
+        k += 1
+
+
+if njit is None:
+    _rref_nb = None
+else:
+    try:
+        _rref_nb = njit(cache=True)(_rref_nb)
+    except RuntimeError:
+        # Numba has no cache locator for modules loaded from a .sublime-package
+        _rref_nb = njit(_rref_nb)
 
 
 def parseMatrix(s):
-    """Returns nested float list from a string"""
+    """Returns float ndarray (nested float list without NumPy) from a string"""
+    tokens = [i.split() for i in s.strip().split("\n") if i != ""]
+    if np is not None:
+        if not tokens or any(len(row) != len(tokens[0]) for row in tokens):
+            return None
+        try:
+            return np.array(tokens, dtype=np.float64)
+        except ValueError:
+            return None
     try:
-        return [[float(i) for i in j.strip().split()] for j in [i for i in s.strip().split("\n") if i != ""]]
+        return [[float(i) for i in row] for row in tokens]
     except ValueError:
         return None
 
 
 def isValidMatrix(m):
     """Returns -1 if invalid matrix, otherwise returns (rows, cols)"""
+    if np is not None and isinstance(m, np.ndarray):
+        return m.shape if m.ndim == 2 and m.size else -1
     if not isinstance(m, list):
         return -1
-    if len(m) == -1:
-        return -1
 
     rows = len(m)
     cols = None
@@ -25,15 +85,10 @@ def isValidMatrix(m):
     for row in m:
         if not isinstance(row, list):
             return -1
-        if len(row) == -1:
-            return -1
         if cols is None:
             cols = len(row)
         if len(row) != cols:
             return -1
-        for el in row:
-            if not isinstance(el, float):
-                return -1
 
     if rows == 0 or cols == 0:
         return -1
@@ -44,7 +99,7 @@ def isValidMatrix(m):
 def getMatrixFromSel(view, index):
     """Returns the `index`-th selected matrix in the view and its dimensions"""
     if index >= len(view.sel()):
-        return None
+        return (None, -1)
     A = parseMatrix(view.substr(view.sel()[index]))
     dim = isValidMatrix(A)
 
@@ -57,28 +112,67 @@ def getMatrixFromSel(view, index):
 def matrixToStr(m):
     """Converts a matrix to a string"""
     stringArr = []
+    colSize = [0]*len(m[0])
 
     for row in m:
-        stringArr.append([])
-        for el in row:
-            stringArr[-1].append(str(round(el, 4)) if int(el)
-                                 != el else str(int(el)))
+        strRow = [str(int(el)) if el.is_integer() else str(round(el, 4))
+                  for el in row]
+        for j, cell in enumerate(strRow):
+            if len(cell) > colSize[j]:
+                colSize[j] = len(cell)
+        stringArr.append(strRow)
+
+    rowFmt = "{{: >{}}}".format(colSize[0]) + \
+        "".join("{{: >{}}}".format(size+1) for size in colSize[1:])
+
+    return "\n".join(rowFmt.format(*row) for row in stringArr)
+
+
+def _mult2(A, B):
+    """Multiplies two 2x2 matrices"""
+    (a, b), (c, d) = A
+    (e, f), (g, h) = B
+    return [[a*e + b*g, a*f + b*h],
+            [c*e + d*g, c*f + d*h]]
 
-    colSize = [max([len(stringArr[j][i])+1 for j in range(len(m))])
-               for i in range(len(m[0]))]
-    colSize[0] -= 1
 
-    s = ""
-    for row in stringArr:
-        for j in range(len(m[0])):
-            s += "{{: >{}}}".format(colSize[j]).format(row[j])
-        s += "\n"
+def _mult3(A, B):
+    """Multiplies two 3x3 matrices"""
+    (a, b, c), (d, e, f), (g, h, i) = A
+    (j, k, l), (m, n, o), (p, q, r) = B
+    return [[a*j + b*m + c*p, a*k + b*n + c*q, a*l + b*o + c*r],
+            [d*j + e*m + f*p, d*k + e*n + f*q, d*l + e*o + f*r],
+            [g*j + h*m + i*p, g*k + h*n + i*q, g*l + h*o + i*r]]
 
-    return s[:-1]
+
+def _inv2(A):
+    """Returns the inverse of a 2x2 matrix, or None if it is singular"""
+    (a, b), (c, d) = A
+    det = a*d - b*c
+    if det == 0:
+        return None
+    return [[d/det, -b/det],
+            [-c/det, a/det]]
+
+
+def _inv3(A):
+    """Returns the inverse of a 3x3 matrix, or None if it is singular"""
+    (a, b, c), (d, e, f), (g, h, i) = A
+    co0 = e*i - f*h
+    co1 = f*g - d*i
+    co2 = d*h - e*g
+    det = a*co0 + b*co1 + c*co2
+    if det == 0:
+        return None
+    return [[co0/det, (c*h - b*i)/det, (b*f - c*e)/det],
+            [co1/det, (a*i - c*g)/det, (c*d - a*f)/det],
+            [co2/det, (b*g - a*h)/det, (a*e - b*d)/det]]
 
 
 def writeMatrix(view, edit, region, m):
     """Writes a matrix to the last selection and clears all others"""
+    if np is not None and isinstance(m, np.ndarray):
+        m = m.tolist()
     s = matrixToStr(m)
     view.replace(edit, region, s)
 
@@ -114,38 +208,8 @@ class MatrixopCommand(sublime_plugin.TextCommand):
         elif operation == "make_insert":
             self.makeInsert(edit)
         elif operation == "help":
-            self.view.window().new_html_sheet("Matrix Calculator Help", """<h1 id="matrix-calculator">Matrix Calculator</h1>
-<p>A matrix has columns split by &quot; &quot; and rows split by &quot;\\n&quot;.</p>
-<p>Example: <br>
-1 2 0 0 <br>
-0 1 2 0 <br>
-0 0 1 2 <br>
-0 0 0 1</p>
-<h2 id="usage">Usage</h2>
-<ul>
-<li>Use multiple selections to choose matrices and perform an operation.</li>
-<li>To quickly insert a matrix, type <code>&lt;rows&gt;x&lt;cols&gt;</code> and press <code>tab</code></li>
-</ul>
-<h2 id="operations-using-command-palette-">Operations (using command palette)</h2>
-<ul>
-<li>Add (+)</li>
-<li>Multiply (*)</li>
-<li>Scale</li>
-<li>Transpose (T)</li>
-<li>Inverse (-1)</li>
-<li>RREF</li>
-<li>Format</li>
-<li>Insert</li>
-<li>Help (open this document)</li>
-</ul>
-<p>Note: When two matrices are used in an operation, the matrix with lower line number is put first.</p>
-<p>Note: Inverse and RREF may not be accurate due to floating point precision.</p>
-<h2 id="helpful-shortcuts">Helpful shortcuts</h2>
-<ul>
-<li>Hold ⌘ for multiple selections</li>
-<li>Hold ⌥ for rectangular selections (will make operations fail, but useful for copy/paste)</li>
-</ul>
-""")
+            self.view.window().new_html_sheet("Matrix Calculator Help", sublime.load_resource(
+                "Packages/{}/help.html".format(__package__)))
 
     def add(self, edit):
         """Add the two selected matrices"""
@@ -171,7 +235,14 @@ class MatrixopCommand(sublime_plugin.TextCommand):
                 "Dimensions do not align ({} != {})".format(dimA[1], dimB[1]))
             return
 
-        C = [[A[i][j]+B[i][j] for j in range(dimA[1])] for i in range(dimA[0])]
+        if np is not None:
+            C = A + B
+        else:
+            C = [[0.0]*dimA[1] for _ in range(dimA[0])]
+            for i in range(dimA[0]):
+                Ai, Bi, Ci = A[i], B[i], C[i]
+                for j in range(dimA[1]):
+                    Ci[j] = Ai[j] + Bi[j]
 
         writeMatrix(self.view, edit, self.view.sel()[1], C)
         clearMatrix(self.view, edit, self.view.sel()[0])
@@ -195,8 +266,19 @@ class MatrixopCommand(sublime_plugin.TextCommand):
                 "Dimensions do not align ({} != {})".format(dimA[1], dimB[0]))
             return
 
-        C = [[sum([A[i][k]*B[k][j] for k in range(dimA[1])])
-              for j in range(dimB[1])] for i in range(dimA[0])]
+        if dimA == dimB == (2, 2):
+            C = _mult2(A, B)
+        elif dimA == dimB == (3, 3):
+            C = _mult3(A, B)
+        elif np is not None:
+            C = A @ B
+        else:
+            Bt = list(zip(*B))
+            C = [[0.0]*dimB[1] for _ in range(dimA[0])]
+            for i in range(dimA[0]):
+                Ai, Ci = A[i], C[i]
+                for j in range(dimB[1]):
+                    Ci[j] = sum(a*b for a, b in zip(Ai, Bt[j]))
 
         writeMatrix(self.view, edit, self.view.sel()[1], C)
         clearMatrix(self.view, edit, self.view.sel()[0])
@@ -216,16 +298,19 @@ class MatrixopCommand(sublime_plugin.TextCommand):
             return
 
         if dimA[0] == 1 and dimA[1] == 1:
-            C, k, out = B, A[0][0], True
-        elif dimB[0] == 1 and dimB[0] == 1:
-            C, k, out = A, B[0][0], False
+            C, k, out = B, float(A[0][0]), True
+        elif dimB[0] == 1 and dimB[1] == 1:
+            C, k, out = A, float(B[0][0]), False
         else:
             self.displayError("At least one input must be a scalar")
             return
 
-        for i in range(len(C)):
-            for j in range(len(C[0])):
-                C[i][j] *= k
+        if np is not None:
+            C = k*C
+        else:
+            for i in range(len(C)):
+                for j in range(len(C[0])):
+                    C[i][j] *= k
 
         writeMatrix(self.view, edit, self.view.sel()[out], C)
         clearMatrix(self.view, edit, self.view.sel()[not out])
@@ -243,14 +328,19 @@ class MatrixopCommand(sublime_plugin.TextCommand):
             self.displayError("Invalid input")
             return
 
-        C = [[A[j][i] for j in range(dimA[0])] for i in range(dimA[1])]
+        if np is not None:
+            C = A.T
+        else:
+            C = [list(row) for row in zip(*A)]
 
         writeMatrix(self.view, edit, self.view.sel()[0], C)
 
     def inverse(self, edit):
         """Invert the selected matrix
 
-        Note: uses row reduction so may not be accurate"""
+        Note: uses row reduction above 3x3 without NumPy so may not be accurate.
+        Only exactly singular matrices are rejected, so nearly singular input
+        such as 0.1 0.2 0.3 / 0.4 0.5 0.6 / 0.7 0.8 0.9 can give huge entries"""
         if len(self.view.sel()) != 1:
             self.displayError(
                 "Incorrect number of matrices ({} != 1)".format(len(self.view.sel())))
@@ -266,19 +356,33 @@ class MatrixopCommand(sublime_plugin.TextCommand):
             self.displayError("Matrix must be square")
             return
 
-        I = [[1 if i == j else 0 for j in range(
-            dimA[0])] for i in range(dimA[0])]
-        B = [A[i] + I[i] for i in range(dimA[0])]
-        self._rref(B, [dimA[0], dimA[0]*2])
-
-        newI = [B[i][:dimA[0]] for i in range(dimA[0])]
-        A_inv = [B[i][dimA[0]:] for i in range(dimA[0])]
-
-        for i in range(dimA[0]):
-            for j in range(dimA[0]):
-                if newI[i][j] != (1 if i == j else 0):
-                    self.displayError("Matrix is not invertible")
-                    return
+        if dimA[0] == 2:
+            A_inv = _inv2(A)
+        elif dimA[0] == 3:
+            A_inv = _inv3(A)
+        elif np is not None:
+            try:
+                A_inv = np.linalg.inv(A)
+            except np.linalg.LinAlgError:
+                A_inv = None
+        else:
+            I = [[1 if i == j else 0 for j in range(
+                dimA[0])] for i in range(dimA[0])]
+            B = [A[i] + I[i] for i in range(dimA[0])]
+            B = self._rref(B, [dimA[0], dimA[0]*2])
+
+            newI = [B[i][:dimA[0]] for i in range(dimA[0])]
+            A_inv = [B[i][dimA[0]:] for i in range(dimA[0])]
+
+            for i in range(dimA[0]):
+                for j in range(dimA[0]):
+                    if newI[i][j] != (1 if i == j else 0):
+                        self.displayError("Matrix is not invertible")
+                        return
+
+        if A_inv is None:
+            self.displayError("Matrix is not invertible")
+            return
 
         writeMatrix(self.view, edit, self.view.sel()[0], A_inv)
 
@@ -295,41 +399,74 @@ class MatrixopCommand(sublime_plugin.TextCommand):
             self.displayError("Invalid input")
             return
 
-        self._rref(A, dimA)
+        A = self._rref(A, dimA)
 
         writeMatrix(self.view, edit, self.view.sel()[0], A)
 
     def _rref(self, A, dim):
-        """Perform row reduction"""
+        """Perform row reduction and return the reduced matrix"""
+        if _rref_nb is not None:
+            _rref_nb(A)
+            return A
+
+        if np is not None:
+            h = 0
+            k = 0
+            while h < dim[0] and k < dim[1]:
+                col = np.abs(A[h:, k])
+                off = int(np.argmax(col))
+                if col[off] == 0.0:
+                    k += 1
+                    continue
+
+                pivot_row = h + off
+                pivot_val = A[pivot_row, k]
+
+                A[[h, pivot_row]] = A[[pivot_row, h]]
+                A[h] /= pivot_val
+                A[h, k] = 1.0
+
+                factors = A[:, k].copy()
+                factors[h] = 0
+                A -= np.outer(factors, A[h])
+
+                h += 1
+                k += 1
+
+            return A
 
         h = 0
         k = 0
         while h < dim[0] and k < dim[1]:
-            pivot_row = 0
-            pivot_val = -1
-            for i in range(h, dim[0]):
-                if abs(A[i][k]) > pivot_val:
+            pivot_row = h
+            for i in range(h+1, dim[0]):
+                if abs(A[i][k]) > abs(A[pivot_row][k]):
                     pivot_row = i
-                    pivot_val = A[i][k]
+            pivot_val = A[pivot_row][k]
 
             if pivot_val == 0:
                 k += 1
                 continue
 
             A[h], A[pivot_row] = A[pivot_row], A[h]
-            A[h] = [i/pivot_val for i in A[h]]
+            row = A[h]
+            for j in range(dim[1]):
+                row[j] /= pivot_val
+            row[k] = 1.0
 
             for i in range(dim[0]):
                 if i == h:
                     continue
                 f = A[i][k]
-                A[i][k] = 0
+                A[i][k] = 0.0
                 for j in range(k+1, dim[1]):
                     A[i][j] = A[i][j] - A[h][j]*f
 
             h += 1
             k += 1
 
+        return A
+
     def format(self, edit):
         """Format the selected matrix"""
         if len(self.view.sel()) != 1: